@@ -1,16 +1,71 @@
-from typing import Literal, Any
+from typing import Literal, Any, Callable
 import asyncio
-from json import dumps
+import base64
+import codecs
+import os
+import re
+import shutil
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import unquote_to_bytes, urlparse
+from urllib.request import url2pathname
 
-import aiofiles
 import aiohttp
+import orjson
+from cachetools import TTLCache
 
 from google.genai import types
 
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
 """
 Tools for the Gemini API
 """
 
+# Files at or below this size are read/written inline; a thread hop costs more than the I/O itself.
+_INLINE_IO_LIMIT = 1024 * 1024
+
+_session: aiohttp.ClientSession | None = None
+
+# Recently read files keyed by (path, st_mtime_ns, st_size), so any change to a file misses the cache.
+_FILE_CACHE_SIZE = 128
+_file_cache: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+
+# Same media types aiohttp's ClientResponse.json() accepts, e.g. application/json and application/problem+json.
+_JSON_CONTENT_TYPE = re.compile(r"^application/(?:[\w.+-]+?\+)?json")
+
+_response_cache: TTLCache = TTLCache(maxsize=256, ttl=60)
+_response_cache_locks: dict[tuple, asyncio.Lock] = {}
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Return the shared HTTP session, creating it on first use.
+
+    The session is backed by a pooled connector so TCP/TLS connections and DNS lookups are reused across `request` calls.
+
+    Returns:
+        aiohttp.ClientSession: The shared session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        # aiodns resolves on the event loop instead of sending a getaddrinfo call to a worker thread.
+        resolver = aiohttp.AsyncResolver() if aiodns is not None else None
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=10, use_dns_cache=True, ttl_dns_cache=300, enable_cleanup_closed=True, resolver=resolver)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60, connect=10))
+    return _session
+
+async def close_session() -> None:
+    """
+    Close the shared HTTP session, if one was created.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
 async def read_file(file_path: str) -> str:
     """
     Read a file and return the content as a string.
@@ -22,10 +77,23 @@ async def read_file(file_path: str) -> str:
         str: Content of the file.
     """
     print("Reading file...")
-    async with aiofiles.open(file_path, mode="r") as file:
-        contents = await file.read()
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    contents = _file_cache.get(key)
+    if contents is not None:
+        _file_cache.move_to_end(key)
         return contents
 
+    # Large files aren't cached, which keeps the cache's memory bounded to _FILE_CACHE_SIZE small files.
+    if stat.st_size > _INLINE_IO_LIMIT:
+        return await asyncio.to_thread(_read_text, file_path)
+
+    contents = _read_text(file_path)
+    _file_cache[key] = contents
+    if len(_file_cache) > _FILE_CACHE_SIZE:
+        _file_cache.popitem(last=False)
+    return contents
+
 async def write_file(file_path: str, content: str) -> None:
     """
     Write content to a file.
@@ -35,8 +103,11 @@ async def write_file(file_path: str, content: str) -> None:
         content (str): Content to write to the file.
     """
     print("Writing to file...")
-    async with aiofiles.open(file_path, mode="w") as file:
-        await file.write(content)
+    if len(content) > _INLINE_IO_LIMIT:
+        await asyncio.to_thread(_write_text, file_path, content, "w")
+    else:
+        _write_text(file_path, content, "w")
+    _forget_file(file_path)
 
 async def append_file(file_path: str, content: str) -> None:
     """
@@ -47,8 +118,42 @@ async def append_file(file_path: str, content: str) -> None:
         content (str): Content to append to the file.
     """
     print("Appending to file...")
-    async with aiofiles.open(file_path, mode="a") as file:
-        await file.write(content)
+    if len(content) > _INLINE_IO_LIMIT:
+        await asyncio.to_thread(_write_text, file_path, content, "a")
+    else:
+        _write_text(file_path, content, "a")
+    _forget_file(file_path)
+
+async def copy_file(source_path: str, destination_path: str) -> None:
+    """
+    Copy a file without loading its content into Python.
+
+    Args:
+        source_path (str): Path to the file to copy.
+        destination_path (str): Path to copy the file to.
+    """
+    print("Copying file...")
+    # shutil.copyfile uses os.sendfile on Linux, so the bytes never leave the kernel.
+    await asyncio.to_thread(shutil.copyfile, source_path, destination_path)
+    _forget_file(destination_path)
+
+def _forget_file(file_path: str) -> None:
+    """
+    Drop cached contents of a file we just wrote. The (mtime, size) key alone can miss a same-length rewrite within one mtime tick.
+
+    Called on the event loop after the write finishes, never from the worker thread, so the cache is only touched from one thread.
+    """
+    path = os.path.abspath(file_path)
+    for key in [key for key in _file_cache if key[0] == path]:
+        del _file_cache[key]
+
+def _read_text(file_path: str) -> str:
+    with open(file_path, mode="r", encoding="utf-8") as file:
+        return file.read()
+
+def _write_text(file_path: str, content: str, mode: str) -> None:
+    with open(file_path, mode=mode, encoding="utf-8") as file:
+        file.write(content)
 
 async def request(
         url: str, 
@@ -68,47 +173,117 @@ async def request(
     Args:
         url (str): The URL to send the request to.
         method (Literal["GET", "POST", "PUT", "DELETE"]): The HTTP method to use.
-        headers (dict, optional): Optional HTTP headers to include in the request.
-        json (Any, optional): JSON data to send in the request body.
+        headers (dict | str, optional): Optional HTTP headers to include in the request. A JSON string is parsed into a dict.
+        json (Any, optional): JSON data to send in the request body. A JSON string is parsed before sending.
         data (Any, optional): Raw data to send in the request body.
-        cookies (Any, optional): Cookies to include with the request.
+        cookies (dict | str, optional): Cookies to include with the request. A JSON string is parsed into a dict.
         allow_redirects (bool, optional): Whether to follow redirects. Defaults to True.
         max_redirects (int, optional): Maximum number of redirects to follow. Defaults to 10.
-        timeout (int, optional): Request timeout in seconds. Defaults to None (no timeout).
+        timeout (int, optional): Request timeout in seconds. Defaults to None (the shared session's 60 second timeout).
 
     Returns:
         dict: The response from the request. The 'content' key holds the response text and 'status' holds the HTTP status.
+
+    `data:` and `file://` URLs are resolved locally without making a network request.
+    Successful GET responses are cached for 60 seconds unless the server sends `Cache-Control: no-store` or `private`.
     """
     print(f"Making {method} request to URL: {url}")
-    if type(headers) == str:
-        headers = dumps(headers)
 
-    async with aiohttp.request(method, url, headers=headers, json=json, data=data, cookies=cookies, allow_redirects=allow_redirects, max_redirects=max_redirects, timeout=timeout) as response:
+    # data: and file:// URLs are answered locally without touching the session.
+    if url.startswith("data:"):
+        media_type, _, payload = url[5:].partition(",")
+        body = unquote_to_bytes(payload)
+        if media_type.endswith(";base64"):
+            body = base64.b64decode(body)
+        return {"content": body.decode("utf-8", errors="replace"), "status": 200}
+    if url.startswith("file://"):
+        # file://notes.txt or file://./notes.txt would otherwise lose their first segment to the host and read the wrong file.
+        parsed = urlparse(url)
+        if parsed.netloc not in ("", "localhost"):
+            raise ValueError(f"file:// URL must have an empty or 'localhost' host, got {parsed.netloc!r}; use file:///absolute/path or read_file for relative paths")
+        return {"content": await read_file(url2pathname(parsed.path)), "status": 200}
+
+    # The tool schema has to declare these as strings, so the model sends JSON text; native values pass straight through.
+    if isinstance(headers, str):
+        headers = _parse_json_argument(headers)
+    if isinstance(json, str):
+        json = _parse_json_argument(json)
+    if isinstance(cookies, str):
+        cookies = _parse_json_argument(cookies)
+
+    if method.upper() != "GET":
+        response_dict, _ = await _send_request(url, method, headers, json, data, cookies, allow_redirects, max_redirects, timeout)
+        return response_dict
+
+    # Concurrent duplicate GETs wait on the same lock so only one of them hits the network.
+    # Redirect settings change which response comes back (a 3xx vs. its target), so they're part of the key.
+    key = (url, allow_redirects, max_redirects, orjson.dumps([headers, cookies, json, data], option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str))
+    cached = _response_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
+    lock = _response_cache_locks.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                return dict(cached)
+
+            response_dict, cacheable = await _send_request(url, method, headers, json, data, cookies, allow_redirects, max_redirects, timeout)
+            if cacheable:
+                _response_cache[key] = response_dict
+            return dict(response_dict)
+    finally:
+        if not lock.locked():
+            _response_cache_locks.pop(key, None)
+
+@lru_cache(maxsize=32)
+def _parse_json_argument(value: str) -> Any:
+    """
+    Parse a request argument passed as a JSON string. Agents tend to reuse the same values, so results are cached; treat them as read-only.
+    """
+    return orjson.loads(value)
+
+async def _send_request(url, method, headers, json, data, cookies, allow_redirects, max_redirects, timeout) -> tuple[dict, bool]:
+    """
+    Send a request through the shared session.
+
+    Returns:
+        tuple[dict, bool]: The response dictionary and whether the response may be cached.
+    """
+    session = await get_session()
+    if timeout is not None:
+        timeout = aiohttp.ClientTimeout(total=timeout, connect=session.timeout.connect)
+    else:
+        timeout = session.timeout
+
+    async with session.request(method, url, headers=headers, json=json, data=data, cookies=cookies, allow_redirects=allow_redirects, max_redirects=max_redirects, timeout=timeout) as response:
         response.raise_for_status()
-        content = await response.text()
-        response_dict = {"content": content, "status": response.status}
+
+        # Read the body once and reuse the bytes for both the text and the JSON payload.
+        chunks = []
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+        body = b"".join(chunks)
+
+        # Like aiohttp's text(), fall back to UTF-8 when the server names a charset Python doesn't know.
+        charset = response.charset or "utf-8"
         try:
-            response_dict["json"] = await response.json()
-        except aiohttp.ContentTypeError:
-            pass
-        return response_dict
+            codecs.lookup(charset)
+        except LookupError:
+            charset = "utf-8"
 
-all_tools = [read_file, write_file, append_file, request]
-
-read_file_tool = {
-    "name": "read_file",
-    "description": "Read a file and return the content as a string.",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "file_path": {
-                "type": "string",
-                "description": "Path to the file to read.",
-                "example": ""
-            }
-        }
-    }
-}
+        response_dict = {"content": body.decode(charset, errors="replace"), "status": response.status}
+        if _JSON_CONTENT_TYPE.match(response.content_type):
+            response_dict["json"] = orjson.loads(body) if body.strip() else None
+
+        cache_control = response.headers.get("Cache-Control", "").lower()
+        cacheable = "no-store" not in cache_control and "private" not in cache_control
+        return response_dict, cacheable
+
+all_tools = [read_file, write_file, append_file, copy_file, request]
+
+TOOL_DISPATCH: dict[str, Callable] = {fn.__name__: fn for fn in all_tools}
 
 read_file_tool = types.FunctionDeclaration(
     name="read_file",
@@ -118,7 +293,7 @@ read_file_tool = types.FunctionDeclaration(
         properties={
             "file_path": types.Schema(
                 type="string",
-                description="Path to the file to read. This is passed directly into the `aiofiles.open` function; thus, both relative and absolute paths are supported.",
+                description="Path to the file to read. This is passed directly into the `open` function; thus, both relative and absolute paths are supported.",
                 example="example.txt",
             )
         }
@@ -133,7 +308,7 @@ write_file_tool = types.FunctionDeclaration(
         properties={
             "file_path": types.Schema(
                 type="string",
-                description="Path to the file to write to. This is passed directly into the `aiofiles.open` function; thus, both relative and absolute paths are supported.",
+                description="Path to the file to write to. This is passed directly into the `open` function; thus, both relative and absolute paths are supported.",
                 example="example.txt",
             ),
             "content": types.Schema(
@@ -153,7 +328,7 @@ append_file_tool = types.FunctionDeclaration(
         properties={
             "file_path": types.Schema(
                 type="string",
-                description="Path to the file to append to. This is passed directly into the `aiofiles.open` function; thus, both relative and absolute paths are supported.",
+                description="Path to the file to append to. This is passed directly into the `open` function; thus, both relative and absolute paths are supported.",
                 example="example.txt",
             ),
             "content": types.Schema(
@@ -165,6 +340,27 @@ append_file_tool = types.FunctionDeclaration(
     )
 )
 
+copy_file_tool = types.FunctionDeclaration(
+    name="copy_file",
+    description="Copy a file to another path. Prefer this over reading a file and writing its content elsewhere.",
+    parameters=types.Schema(
+        type="object",
+        properties={
+            "source_path": types.Schema(
+                type="string",
+                description="Path to the file to copy. Both relative and absolute paths are supported.",
+                example="example.txt",
+            ),
+            "destination_path": types.Schema(
+                type="string",
+                description="Path to copy the file to. An existing file at this path is overwritten. Both relative and absolute paths are supported.",
+                example="copy.txt",
+            )
+        },
+        required=["source_path", "destination_path"]
+    )
+)
+
 request_tool = types.FunctionDeclaration(
     name="request",
     description="Perform an asynchronous HTTP request with the specified method and return the response as a dictionary.",
@@ -214,7 +410,7 @@ request_tool = types.FunctionDeclaration(
             ),
             "timeout": types.Schema(
                 type="integer",
-                description="Request timeout in seconds. Defaults to None (no timeout).",
+                description="Request timeout in seconds. Defaults to None (60 seconds).",
                 nullable=True,
                 example=30,
             ),
@@ -223,4 +419,7 @@ request_tool = types.FunctionDeclaration(
     ),
 )
 
-function_declarations = [read_file_tool, write_file_tool, append_file_tool, request_tool]
\ No newline at end of file
+function_declarations = [read_file_tool, write_file_tool, append_file_tool, copy_file_tool, request_tool]
+
+# Built once so every LiveConnectConfig shares the same validated Tool.
+function_tool = types.Tool(function_declarations=function_declarations)
\ No newline at end of file
@@ -1,9 +1,19 @@
 import asyncio
+import functools
 import logging
 import os
+import random
+import sys
+from collections import deque
 
-from dotenv import load_dotenv
 from websockets import ConnectionClosedError
+from prompt_toolkit import PromptSession
+from prompt_toolkit.history import FileHistory
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 from google import genai
 from google.genai import types
@@ -15,45 +25,134 @@ import gemini_tools
 # https://github.com/google-gemini/cookbook/blob/main/quickstarts/Get_started_LiveAPI.py
 # 
 
-load_dotenv()
+# Only scan for a .env file when the key isn't already in the environment.
+if "GOOGLE_API_KEY" not in os.environ and "GEMINI_API_KEY" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+_API_KEY = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
 
 logging.basicConfig(level="INFO")
 logger = logging.getLogger(__name__)
 
+# Streamed text is held for this many seconds so consecutive chunks go out in a single write,
+# unless this many characters pile up first.
+OUTPUT_FLUSH_DELAY = 0.02
+OUTPUT_FLUSH_SIZE = 4096
+
+EXECUTABLE_CODE_HEADER = '--------Executable Code--------\n'
+CODE_EXECUTION_RESULT_HEADER = '-----Code Execution Result-----\n'
+DIVIDER = '-------------------------------\n'
+
+# Only the most recent turns are kept in GeminiChat.history, so long sessions don't grow without bound.
+HISTORY_LENGTH = 256
+
+# Dropped connections are retried with exponential backoff (plus jitter) before giving up.
+RECONNECT_ATTEMPTS = 5
+RECONNECT_BACKOFF = 0.5
+RECONNECT_BACKOFF_MAX = 30
+
+TEXT_ONLY_MODALITIES = (types.Modality.TEXT,)
+
+DEFAULT_SYSTEM_INSTRUCTION = "You are a helpful assistant running on the Google Gemini 2.0 Flash Exp model. You are running through the Multimodal Live API. Answer prompts concisely."
+
+
+@functools.cache
+def _default_config() -> types.LiveConnectConfig:
+    """
+    Build the config used when GeminiChat is not given one. Built once; callers should copy it before modifying.
+    """
+    return types.LiveConnectConfig(
+        response_modalities=list(TEXT_ONLY_MODALITIES),
+        system_instruction=types.Content(parts=[types.Part(text=DEFAULT_SYSTEM_INSTRUCTION)]),
+        tools=[types.Tool(google_search=types.GoogleSearch())],
+    )
+
+
+@functools.cache
+def _get_client(api_key: str | None, api_version: str = "v1alpha") -> genai.Client:
+    """
+    Return a genai.Client for the given key and API version, shared by every chat that uses them.
+    """
+    return genai.Client(api_key=api_key, http_options={'api_version': api_version})
+
+
+def _text_content(text: str, role: str) -> types.Content:
+    """
+    Build a single-part text Content. The fields are plain strings we control, so pydantic validation is skipped.
+    """
+    return types.Content.model_construct(parts=[types.Part.model_construct(text=text)], role=role)
+
 
 class GeminiChat:
+    __slots__ = ("client", "model", "config", "session", "history", "_prompt", "_output_buffer", "_output_size", "_flush_handle", "_pending_query")
+
     def __init__(self, api_key: str | None = None, config: types.LiveConnectConfig | None = None, model: str = "gemini-2.0-flash-exp"):
         """
         Initialize the GeminiChat class, which uses the Multimodal Live API with Google's gemini-2.0-flash-exp model.
 
         Args:
-            api_key (str, optional): API key for the Gemini API. Defaults to None.
+            api_key (str, optional): API key for the Gemini API. Defaults to None (the GOOGLE_API_KEY or GEMINI_API_KEY environment variable).
             config (LiveConnectConfig, optional): Configuration for the chatbot. Defaults to None. Include system instructions and tools here.
             model (str, optional): Gemini model name to use for the chatbot. Defaults to "gemini-2.0-flash-exp". Note that "gemini-2.0-flash" is not supported.
         """
-        self.client = genai.Client(api_key=api_key or os.getenv("GOOGLE_API_KEY"), http_options={'api_version': 'v1alpha'})
+        self.client = _get_client(api_key or _API_KEY)
 
         self.model = model
 
         if config:
             self.config = config
-            if config.response_modalities != [types.Modality.TEXT]:
-                logger.warning("Response modalities other than TEXT are not supported.")
-                config.response_modalities = [types.Modality.TEXT]
-            if config.response_modalities is None:
-                config.response_modalities = [types.Modality.TEXT]
+            if tuple(config.response_modalities or ()) != TEXT_ONLY_MODALITIES:
+                if config.response_modalities is not None:
+                    logger.warning("Response modalities other than TEXT are not supported.")
+                config.response_modalities = list(TEXT_ONLY_MODALITIES)
         else:
-            self.config = types.LiveConnectConfig(
-                response_modalities=[types.Modality.TEXT],
-                system_instruction=types.Content(parts=[types.Part(text="You are a helpful assistant running on the Google Gemini 2.0 Flash Exp model. You are running through the Multimodal Live API. Answer prompts concisely.")]),
-                tools=[types.Tool(google_search=types.GoogleSearch())],
-            )
+            self.config = _default_config().model_copy(deep=True)
         
         self.session = None
 
-        self.history = [
-            types.Content(parts=[types.Part(text=system_instruction)], role="system")
-        ]
+        # Prompt whose turn hasn't completed yet; resent after a reconnect.
+        self._pending_query: str | None = None
+
+        # prompt_toolkit reads input natively on the event loop and keeps line editing and history across turns.
+        self._prompt = PromptSession(history=FileHistory(".gemini_history"))
+
+        self._output_buffer: list[str] = []
+        self._output_size = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+        self.history: deque[types.Content] = deque(
+            [_text_content(system_instruction, "system")],
+            maxlen=HISTORY_LENGTH,
+        )
+
+    def write_output(self, text: str):
+        """
+        Queue text for stdout. Queued text is written in one go shortly afterwards, once enough of it has built up, or on the next `flush_output`.
+
+        Args:
+            text (str): Text to write.
+        """
+        self._output_buffer.append(text)
+        self._output_size += len(text)
+        if self._output_size >= OUTPUT_FLUSH_SIZE:
+            self.flush_output()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(OUTPUT_FLUSH_DELAY, self.flush_output)
+
+    def flush_output(self):
+        """
+        Write any queued output to stdout immediately.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._output_buffer:
+            sys.stdout.write("".join(self._output_buffer))
+            self._output_buffer.clear()
+            self._output_size = 0
+        sys.stdout.flush()
 
     async def handle_server_content(self, server_content: types.LiveServerContent):
         """
@@ -68,19 +167,43 @@ class GeminiChat:
             for part in model_turn.parts:
                 executable_code = part.executable_code
                 if executable_code is not None:
-                    print('--------Executable Code--------')
-                    print(f'``` {str(executable_code.language).lower()}\n{executable_code.code}\n```')
-                    print('-------------------------------')
+                    self.write_output(f'{EXECUTABLE_CODE_HEADER}``` {str(executable_code.language).lower()}\n{executable_code.code}\n```\n{DIVIDER}')
 
                 code_execution_result = part.code_execution_result
                 if code_execution_result is not None:
-                    print('-----Code Execution Result-----')
-                    print(f'```\n{code_execution_result}\n```')
-                    print('-------------------------------')
+                    self.write_output(f'{CODE_EXECUTION_RESULT_HEADER}```\n{code_execution_result}\n```\n{DIVIDER}')
 
         grounding_metadata = getattr(server_content, 'grounding_metadata', None)
-        if grounding_metadata is not None:
-            logger.info(grounding_metadata.search_entry_point.rendered_content)
+        if grounding_metadata is not None and logger.isEnabledFor(logging.INFO):
+            search_entry_point = grounding_metadata.search_entry_point
+            if search_entry_point is not None:
+                logger.info(search_entry_point.rendered_content)
+
+    async def call_function(self, function_call: types.FunctionCall) -> types.FunctionResponse:
+        """
+        Run a single function call requested by the model.
+
+        Args:
+            function_call (FunctionCall): Function call received from the Multimodal Live API.
+
+        Returns:
+            FunctionResponse: The response to send back, with the result under 'output' or the failure under 'error'.
+        """
+        func = gemini_tools.TOOL_DISPATCH.get(function_call.name)
+        if func is None:
+            response = {"error": f"Function '{function_call.name}' not found."}
+        else:
+            try:
+                response = {"output": await func(**function_call.args)}
+            except Exception as e:
+                response = {"error": str(e)}
+
+        # The fields come straight from the server's function call and our own dict, so skip pydantic validation.
+        return types.FunctionResponse.model_construct(
+            name=function_call.name,
+            id=function_call.id,
+            response=response,
+        )
 
     async def handle_tool_call(self, tool_call: types.LiveServerToolCall):
         """
@@ -90,115 +213,190 @@ class GeminiChat:
             tool_call (LiveServerToolCall): Tool call received from the Multimodal Live API.
         """
 
-        print('--------Handle Tool Call-------')
-        responses = []
-        for function_call in tool_call.function_calls:
-            print("Function Call: " + str(function_call))
-            
-            func = getattr(gemini_tools, function_call.name, None)
-            if func is not None:
-                try:
-                    result = await func(**function_call.args)
-                    response = {"output": result}
-                except Exception as e:
-                    response = {"error": str(e)}
-            else:
-                response = {"error": f"Function '{function_call.name}' not found."}
-
-            responses.append(types.FunctionResponse(
-                name=function_call.name,
-                id=function_call.id,
-                response=response,
-            ))
-        
-        tool_response = types.LiveClientToolResponse(
+        self.flush_output()
+        logger.debug("Function calls: %s", tool_call.function_calls)
+
+        # Independent calls run concurrently; gather preserves the order of function_calls.
+        responses = await asyncio.gather(*(self.call_function(function_call) for function_call in tool_call.function_calls))
+
+        tool_response = types.LiveClientToolResponse.model_construct(
             function_responses=responses,
         )
 
-        print('Tool Response: ' + str(tool_response))
-        print('-------------------------------')
-
+        logger.debug("Tool response: %s", tool_response)
 
         await self.session.send(input=tool_response)
 
+    async def read_queries(self, queries: asyncio.Queue):
+        """
+        Read prompts from the user and queue them for `answer_queries`. None is queued when the user quits.
+
+        Args:
+            queries (Queue): Queue the prompts are put on.
+        """
+        while True:
+            try:
+                query = await self._prompt.prompt_async("User   > ")
+            except (EOFError, KeyboardInterrupt):
+                # Ctrl-D and Ctrl-C both quit; a KeyboardInterrupt escaping this task would abort the event loop with a traceback.
+                query = "quit"
+
+            query = query.strip()
+            if not query:
+                continue # Prevent sending empty queries
+
+            elif query.lower() == "quit":
+                queries.put_nowait(None)
+                return
+
+            queries.put_nowait(query)
+            await queries.join() # Prompt again once the answer has been printed
+
+    async def answer_queries(self, queries: asyncio.Queue):
+        """
+        Send queued prompts to the model and stream back its responses until None is received.
+
+        A prompt whose turn was cut off by a dropped connection is answered first, before the queue is read again.
+
+        Args:
+            queries (Queue): Queue filled by `read_queries`.
+        """
+        while True:
+            if self._pending_query is None:
+                query = await queries.get()
+                if query is None:
+                    queries.task_done()
+                    return
+                self._pending_query = query
+
+            # If the connection drops mid-turn, the query stays pending and isn't marked done,
+            # so `read_queries` keeps waiting instead of prompting over the reconnect.
+            await self.answer_query(self._pending_query)
+            self._pending_query = None
+            queries.task_done()
+
+    async def answer_query(self, query: str):
+        """
+        Send a single prompt to the model and stream back its response.
+
+        Args:
+            query (str): Prompt to send.
+        """
+        # The turn is only added to history once it completes, so the prefix replayed on reconnect never ends in a half-finished turn.
+        user_content = _text_content(query, "user")
+
+        await self.session.send(input=query, end_of_turn=True)
+
+        self.write_output("Gemini > ")
+        # Text chunks are joined into a single Part when the turn ends; other parts (code, results) are kept as-is.
+        text_parts: list[str] = []
+        other_parts: list[types.Part] = []
+
+        async for response in self.session.receive(): # type(response) = types.LiveServerMessage
+            # Read each field once; `text` in particular is a property that joins the parts on every access.
+            text = response.text
+            server_content = response.server_content
+            tool_call = response.tool_call
+
+            model_turn = server_content.model_turn if server_content is not None else None # type(model_turn) = types.Content
+            if model_turn is not None and model_turn.parts:
+                other_parts.extend(part for part in model_turn.parts if part.text is None)
+
+            if text:
+                text_parts.append(text)
+                self.write_output(text)
+            elif server_content:
+                await self.handle_server_content(server_content)
+            elif tool_call:
+                await self.handle_tool_call(tool_call)
+
+        self.flush_output()
+        parts = [types.Part.model_construct(text="".join(text_parts)), *other_parts] if text_parts else other_parts
+        self.history.extend((user_content, types.Content.model_construct(parts=parts, role="model")))
+
+    async def replay_history(self):
+        """
+        Send the recorded conversation to a new session in one message, so the model picks up where the last session left off.
+        """
+        turns = [content for content in self.history if content.role != "system"]
+        if turns:
+            await self.session.send(input=types.LiveClientContent(turns=turns, turn_complete=False))
+
+    async def converse(self, queries: asyncio.Queue):
+        """
+        Connect to the Multimodal Live API and answer queued prompts, reconnecting if the connection drops.
+        After a reconnect the history is replayed and the interrupted prompt is sent again.
+
+        Args:
+            queries (Queue): Queue filled by `read_queries`.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self.client.aio.live.connect(model=self.model, config=self.config) as session:
+                    self.session = session
+                    if attempt:
+                        await self.replay_history()
+                        attempt = 0
+
+                    await self.answer_queries(queries)
+                    return
+
+            except ConnectionClosedError as e:
+                attempt += 1
+                if attempt > RECONNECT_ATTEMPTS:
+                    raise
+
+                delay = min(RECONNECT_BACKOFF * 2 ** (attempt - 1), RECONNECT_BACKOFF_MAX) + random.random() * 0.25
+                logger.warning(e)
+                self.flush_output()
+                print(f"\nSystem > The connection was lost. Reconnecting in {delay:.1f} seconds...", flush=True)
+                await asyncio.sleep(delay)
+
     async def run(self):
+        print("Welcome to Gemini ChatBot! Type 'quit' to exit.")
+
         try:
-            async with self.client.aio.live.connect(model=self.model, config=self.config) as session:
-                self.session = session
-
-                print("Welcome to Gemini ChatBot! Type 'quit' to exit.")
-
-                while True:
-
-                    query = input("User   > ")
-                    if query.lower() == "quit":
-                        raise KeyboardInterrupt("User exited the chat.")
-                    
-                    elif query.strip() == "":
-                        continue # Prevent sending empty queries
-
-                    self.history.append(types.Content(parts=[types.Part(text=query)], role="user"))
-    
-                    await self.session.send(input=query, end_of_turn=True)
-
-                    print("Gemini > ", end="")
-                    full_response = []
-                    
-                    async for response in self.session.receive(): # type(response) = types.LiveServerMessage
-                        #print(response)
-                        
-                        try:
-                            if response.server_content.model_turn is not None: # type(response.server_content.model_turn) = types.Content
-                                full_response.append(response.server_content.model_turn.parts[0])
-                        except:
-                            print("Strange Response: " + str(response))
-
-                        if response.text:
-                            print(response.text, end="")
-                            continue
-
-                        if response.server_content:
-                            await self.handle_server_content(response.server_content)
-                            continue
-
-                        if response.tool_call:
-                            await self.handle_tool_call(response.tool_call)
-                            continue
-                            
-
-                    self.history.append(types.Content(parts=full_response, role="model"))
-
-        except asyncio.CancelledError as e:
-            print("\nSystem > The chat has been cancelled. Goodbye!")
+            # Input runs in its own task so the session keeps being serviced while the user types.
+            # If either task fails, the TaskGroup cancels the other and raises the failure below.
+            queries = asyncio.Queue()
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(self.converse(queries))
+                tasks.create_task(self.read_queries(queries))
 
-        except KeyboardInterrupt as e:
             print("System > Exiting the chat. Goodbye!")
 
-        except ConnectionClosedError as e:
-            logger.error(e)
+        except* asyncio.CancelledError:
+            print("\nSystem > The chat has been cancelled. Goodbye!")
+
+        except* KeyboardInterrupt:
+            print("\nSystem > Exiting the chat. Goodbye!")
+
+        except* ConnectionClosedError as group:
+            for e in group.exceptions:
+                logger.error(e)
             print("\nSystem > The session timed out.")
 
-        except APIError as e:
-            logger.error(type(e))
-            logger.error(e)
+        except* APIError:
+            logger.exception("Gemini API error")
             print("\nSystem > The API ran into a problem. Please try again later.")
 
-        except Exception as e:
-            logger.error(type(e))
-            logger.error(e)
+        except* Exception:
+            logger.exception("Chat loop failed")
             print(f"System > An error occured. Please try again later.")
-        
-        print("System > " + str(self.history))
+
+        # Formatting the full history is only worth it when someone is going to read it.
+        logger.debug("History: %s", self.history)
 
 
 tools = [
     types.Tool(google_search=types.GoogleSearch()),
     types.Tool(code_execution=types.ToolCodeExecution()),
-    types.Tool(function_declarations=gemini_tools.function_declarations),
+    gemini_tools.function_tool,
 ]
 
 system_instruction = """
-You are a helpful assistant running on the Google Gemini 2.0 Flash Exp model. You are running on VSCode through the Multimodal Live API. To close the chat, the user must type 'quit.' Answer prompts concisely. 
+You are a helpful assistant running on the Google Gemini 2.0 Flash Exp model. You are running on VSCode through the Multimodal Live API. To close the chat, the user must type 'quit.' Answer prompts concisely. To copy a file, use copy_file rather than read_file followed by write_file.
 """
 
 config = types.LiveConnectConfig(
@@ -206,5 +404,24 @@ config = types.LiveConnectConfig(
     system_instruction=types.Content(parts=[types.Part(text=system_instruction)]),
     response_modalities=["TEXT"],
 )
-chat = GeminiChat(config=config)
-asyncio.run(chat.run())
\ No newline at end of file
+
+
+async def main():
+    chat = GeminiChat(config=config)
+    try:
+        await chat.run()
+    finally:
+        try:
+            await gemini_tools.close_session()
+        finally:
+            await chat.client.aio.aclose()
+            _get_client.cache_clear()
+
+
+if __name__ == "__main__":
+    # Output is flushed explicitly by GeminiChat.flush_output, so newlines in streamed text shouldn't force extra flushes.
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())